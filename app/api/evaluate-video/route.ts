@@ -1,5 +1,5 @@
 import { NextRequest, NextResponse } from "next/server";
-import { spawn } from 'child_process';
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
 import path from 'path';
 import { supabase } from '@/lib/supabase';
 // import { Groq } from 'groq-sdk';
@@ -85,45 +85,165 @@ ${frameDescriptions.join('\n')}`;
   return result;
 }
 
-async function extractFramesWithPython(videoUrl: string) {
-  return new Promise<z.infer<typeof ExtractionResultSchema>>((resolve, reject) => {
-    // Path to Python script (relative to project root)
-    const scriptPath = path.join(process.cwd(), 'scripts', 'extract_frames.py');
-    
-    // Use system Python directly
-    const pythonProcess = spawn('python3', [scriptPath, videoUrl]);
-    
-    let outputData = '';
-    let errorData = '';
+type ExtractionResult = z.infer<typeof ExtractionResultSchema>;
+
+type PendingExtraction = {
+  videoUrl: string;
+  timer?: ReturnType<typeof setTimeout>;
+  resolve: (result: ExtractionResult) => void;
+  reject: (error: Error) => void;
+};
+
+type FramesDaemon = {
+  process: ChildProcessWithoutNullStreams;
+  pending: PendingExtraction[];
+};
+
+// A small pool of long-lived `extract_frames.py --daemon` processes handles every
+// request, so Python and OpenCV start once instead of per video. Each daemon
+// answers requests in the order they were written, one JSON line each.
+const FRAMES_DAEMON_COUNT = 2;
+// Longest a single extraction may run before its daemon is restarted, so a
+// stalled download or very long video cannot hold up the requests behind it
+const EXTRACTION_TIMEOUT_MS = 5 * 60 * 1000;
+const framesDaemons: Array<FramesDaemon | null> = new Array(FRAMES_DAEMON_COUNT).fill(null);
+
+// Don't leave Python processes behind when the server (or a dev reload) exits
+process.once('exit', () => {
+  for (const daemon of framesDaemons) {
+    daemon?.process.kill();
+  }
+});
 
-    pythonProcess.stdout.on('data', (data) => {
-      outputData += data.toString();
-    });
+// A daemon works through its queue in order, so only the request at the head
+// is running; its clock starts there rather than when it was queued
+function startHeadTimer(daemon: FramesDaemon) {
+  const head = daemon.pending[0];
+  if (!head || head.timer) {
+    return;
+  }
+  head.timer = setTimeout(() => restartFramesDaemon(daemon, head), EXTRACTION_TIMEOUT_MS);
+}
 
-    pythonProcess.stderr.on('data', (data) => {
-      errorData += data.toString();
-      console.error('Python stderr:', errorData);
-    });
+function startFramesDaemon(slot: number) {
+  // Path to Python script (relative to project root)
+  const scriptPath = path.join(process.cwd(), 'scripts', 'extract_frames.py');
 
-    pythonProcess.on('error', (error) => {
-      console.error('Failed to start Python process:', error);
-      reject(new Error(`Failed to start Python process: ${error.message}`));
-    });
+  // Use system Python directly
+  const daemon: FramesDaemon = {
+    process: spawn('python3', [scriptPath, '--daemon']),
+    pending: []
+  };
+  framesDaemons[slot] = daemon;
+
+  let outputData = '';
+
+  daemon.process.stdout.on('data', (data) => {
+    outputData += data.toString();
 
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        console.error('Python script error:', errorData);
-        reject(new Error(`Python script failed with code ${code}: ${errorData}`));
-        return;
+    let newlineIndex;
+    while ((newlineIndex = outputData.indexOf('\n')) !== -1) {
+      const line = outputData.slice(0, newlineIndex);
+      outputData = outputData.slice(newlineIndex + 1);
+
+      const pending = daemon.pending.shift();
+      if (!pending) {
+        continue;
       }
+      startHeadTimer(daemon);
 
       try {
-        const result = ExtractionResultSchema.parse(JSON.parse(outputData));
-        resolve(result);
+        pending.resolve(ExtractionResultSchema.parse(JSON.parse(line)));
       } catch (error) {
-        reject(new Error('Failed to parse Python script output', { cause: error }));
+        pending.reject(new Error('Failed to parse Python script output', { cause: error }));
       }
-    });
+    }
+  });
+
+  daemon.process.stderr.on('data', (data) => {
+    console.error('Python stderr:', data.toString());
+  });
+
+  // Fail everything still waiting and let the next request start a fresh process
+  const failPending = (error: Error) => {
+    if (framesDaemons[slot] === daemon) {
+      framesDaemons[slot] = null;
+    }
+    for (const pending of daemon.pending.splice(0)) {
+      pending.reject(error);
+    }
+  };
+
+  daemon.process.on('error', (error) => {
+    console.error('Failed to start Python process:', error);
+    failPending(new Error(`Failed to start Python process: ${error.message}`));
+  });
+
+  daemon.process.stdin.on('error', (error) => {
+    failPending(new Error(`Failed to write to Python process: ${error.message}`));
+  });
+
+  daemon.process.on('close', (code) => {
+    failPending(new Error(`Python script exited with code ${code}`));
+  });
+
+  return daemon;
+}
+
+function getFramesDaemon() {
+  // Send each request to the daemon with the shortest queue
+  let chosen: FramesDaemon | null = null;
+  for (let slot = 0; slot < FRAMES_DAEMON_COUNT; slot++) {
+    const daemon = framesDaemons[slot] ?? startFramesDaemon(slot);
+    if (!chosen || daemon.pending.length < chosen.pending.length) {
+      chosen = daemon;
+    }
+  }
+  return chosen as FramesDaemon;
+}
+
+function submitExtraction(pending: PendingExtraction) {
+  const daemon = getFramesDaemon();
+  daemon.pending.push(pending);
+  daemon.process.stdin.write(`${JSON.stringify(pending.videoUrl)}\n`);
+  startHeadTimer(daemon);
+}
+
+function restartFramesDaemon(daemon: FramesDaemon, timedOut: PendingExtraction) {
+  const slot = framesDaemons.indexOf(daemon);
+  if (slot !== -1) {
+    framesDaemons[slot] = null;
+  }
+
+  const queued = daemon.pending.splice(0);
+  daemon.process.kill();
+  timedOut.reject(new Error(`Frame extraction timed out after ${EXTRACTION_TIMEOUT_MS / 1000}s`));
+
+  // The other requests on the killed daemon get retried on a fresh one, where
+  // their clocks restart once they reach the head of its queue
+  for (const pending of queued) {
+    if (pending !== timedOut) {
+      clearTimeout(pending.timer);
+      pending.timer = undefined;
+      submitExtraction(pending);
+    }
+  }
+}
+
+async function extractFramesWithPython(videoUrl: string) {
+  return new Promise<ExtractionResult>((resolve, reject) => {
+    const pending: PendingExtraction = {
+      videoUrl,
+      resolve: (result) => {
+        clearTimeout(pending.timer);
+        resolve(result);
+      },
+      reject: (error) => {
+        clearTimeout(pending.timer);
+        reject(error);
+      }
+    };
+    submitExtraction(pending);
   });
 }
 
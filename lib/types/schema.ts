@@ -574,6 +574,10 @@ export type Database = {
       [_ in never]: never
     }
     Functions: {
+      ad_analyses_checksum: {
+        Args: Record<PropertyKey, never>
+        Returns: string
+      }
       fetch_library_items: {
         Args: {
           user_id: string
@@ -661,6 +665,12 @@ export type Database = {
           similarity: number
         }[]
       }
+      set_market_research_keywords: {
+        Args: {
+          updates: Json
+        }
+        Returns: number
+      }
     }
     Enums: {
       library_item_type: "image" | "video"
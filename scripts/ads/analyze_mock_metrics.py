@@ -1,81 +1,108 @@
+import time
+from functools import cache
+from pathlib import Path
 from matplotlib import pyplot as plt
 from helpers import get_features_and_metrics_from_db
-from models import JoinedFeatureMetric
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import seaborn as sns
 
 
-def open_and_save_csv():
-    joined_features: list[JoinedFeatureMetric] = get_features_and_metrics_from_db()
+@cache
+def load_joined_df(
+    cache_file: str = "joined_features_and_metrics.parquet", ttl: float = 3600
+) -> pd.DataFrame:
+    # Reuse the last fetch while it is fresh so re-plotting doesn't hit the DB
+    cache_path = Path(cache_file)
+    if cache_path.exists() and time.time() - cache_path.stat().st_mtime < ttl:
+        return pd.read_parquet(cache_path)
+
+    df = get_features_and_metrics_from_db()
+    # Narrow dtypes halve memory for the groupby/median passes, and
+    # low-cardinality labels are cheaper to group on as categoricals
+    df = df.astype(
+        {
+            "clicks": "int32",
+            "impressions": "int32",
+            "ctr": "float32",
+            "confidence_score": "float32",
+            "keyword": "category",
+            "category": "category",
+            "location": "category",
+        }
+    )
+    df.to_parquet(cache_path, compression="zstd")
+    return df
 
-    # Convert the list of JoinedFeatureMetric objects to a DataFrame
-    df = pd.DataFrame([jf.__dict__ for jf in joined_features])
 
+def open_and_save_csv(df: pd.DataFrame):
     # Save the DataFrame to a CSV file
     output_file = "joined_features_and_metrics.csv"
-    df.to_csv(output_file, index=False)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Decode categorical columns back to plain strings for the CSV writer
+    table = table.cast(
+        pa.schema(
+            [
+                (
+                    field.with_type(field.type.value_type)
+                    if pa.types.is_dictionary(field.type)
+                    else field
+                )
+                for field in table.schema
+            ]
+        )
+    )
+    pa_csv.write_csv(table, output_file)
     print(f"Data saved to {output_file}")
 
 
-def box_plot_ctr_by_category():
-    joined_features: list[JoinedFeatureMetric] = get_features_and_metrics_from_db()
-
-    df = pd.DataFrame([jf.__dict__ for jf in joined_features])
-
-    df["category_label_pair"] = df["category"] + " " + df["location"]
-    df["category_only"] = df["category_label_pair"].str.split().str[0]
+def box_plot_ctr_by_category(df: pd.DataFrame):
+    pair_columns = ["category", "location"]
 
     # Set the minimum number of data points required for a category
     min_data_points = 2
 
-    # Filter categories with sufficient data
-    category_counts = df["category_label_pair"].value_counts()
-    categories_with_sufficient_data = category_counts[
-        category_counts >= min_data_points
-    ].index
-
     # Filter the dataframe to include only categories with sufficient data
-    df_filtered = df[df["category_label_pair"].isin(categories_with_sufficient_data)]
+    pair_counts = df.groupby(pair_columns, observed=True)["ctr"].transform("size")
+    df_filtered = df[pair_counts >= min_data_points]
 
-    # Calculate the median CTR for each category_label_pair
-    median_ctr = df_filtered.groupby("category_label_pair")["ctr"].median()
+    # Calculate the median CTR for each category/location pair
+    median_ctr = df_filtered.groupby(pair_columns, observed=True)["ctr"].median()
 
     # Sort by category, then by median CTR within each category
-    sorted_categories = (
-        df_filtered.groupby("category_only")
-        .apply(
-            lambda x: x.sort_values(
-                by="category_label_pair", key=lambda y: median_ctr[y], ascending=False
-            )
-        )
-        .reset_index(drop=True)["category_label_pair"]
-        .unique()
+    sorted_pairs = pd.MultiIndex.from_frame(
+        median_ctr.reset_index()
+        .sort_values(["category", "ctr"], ascending=[True, False])[pair_columns]
+        .astype(str)
     )
 
-    # Order the category_label_pair based on the new sorting
-    df_filtered["category_label_pair"] = pd.Categorical(
-        df_filtered["category_label_pair"], categories=sorted_categories, ordered=True
+    # Position of each row's pair in the sorted order, used as the box index
+    pair_positions = sorted_pairs.get_indexer(
+        pd.MultiIndex.from_frame(df_filtered[pair_columns].astype(str))
     )
 
     # Create a color palette for main categories
-    unique_categories = df_filtered["category_only"].unique()
+    unique_categories = sorted_pairs.get_level_values("category").unique()
     color_palette = sns.color_palette("husl", n_colors=len(unique_categories))
     color_dict = dict(zip(unique_categories, color_palette))
 
     # Create a list of colors for each box
-    box_colors = [
-        color_dict[cat]
-        for cat in df_filtered["category_label_pair"].cat.categories.str.split().str[0]
-    ]
+    box_colors = [color_dict[category] for category, _ in sorted_pairs]
 
     plt.figure(figsize=(12, 14))  # Adjust figure size for better visibility
     ax = sns.boxplot(
-        x="ctr",
-        y="category_label_pair",
-        data=df_filtered,
+        x=df_filtered["ctr"].to_numpy(),
+        y=pair_positions,
+        orient="h",
+        order=range(len(sorted_pairs)),
         showfliers=False,
         palette=box_colors,
     )
+    ax.set_yticks(range(len(sorted_pairs)))
+    ax.set_yticklabels(
+        [f"{category} {location}" for category, location in sorted_pairs]
+    )
     plt.title(
         f"CTR by Category and Location (Outliers Removed, Min {min_data_points} data points)"
     )
@@ -97,4 +124,5 @@ def box_plot_ctr_by_category():
 
 
 if __name__ == "__main__":
-    box_plot_ctr_by_category()
+    df = load_joined_df()
+    box_plot_ctr_by_category(df)
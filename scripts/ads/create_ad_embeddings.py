@@ -1,65 +1,134 @@
+import asyncio
+import numpy as np
 from models import AdStructuredOutput
 from helpers import get_supabase_client
-from openai import OpenAI
+from openai import APITimeoutError, AsyncOpenAI, BadRequestError, RateLimitError
 import os
 from dotenv import load_dotenv
 from tqdm import tqdm
-import multiprocessing as mp
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    wait_exponential_jitter,
+    retry_if_exception_type,
+)
 
 load_dotenv("../../.env.local")
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Retries are handled by tenacity and wait_out_rate_limit below, so the SDK's
+# own retries are turned off rather than stacked on top
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
 
+# Number of descriptions sent per embeddings request
+BATCH_SIZE = 256
+MAX_CONCURRENT_REQUESTS = 16
 
-def create_embedding(ad_structured_output: AdStructuredOutput | None):
-    if ad_structured_output is None:
-        return
+# Cleared while a rate limit is being waited out so every batch holds off
+rate_limit_clear = asyncio.Event()
+rate_limit_clear.set()
+
+
+async def wait_out_rate_limit(error: RateLimitError):
+    retry_after = float(error.response.headers.get("retry-after", 1))
+    rate_limit_clear.clear()
+    await asyncio.sleep(retry_after)
+    rate_limit_clear.set()
 
+
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    retry=retry_if_exception_type((RateLimitError, APITimeoutError)),
+)
+async def request_embeddings(descriptions: list[str]):
+    await rate_limit_clear.wait()
     try:
-        embedding: list[float] = (
-            client.embeddings.create(
-                input=ad_structured_output.image_description,
-                model="text-embedding-3-small",
-            )
-            .data[0]
-            .embedding
+        return await client.embeddings.create(
+            input=descriptions, model="text-embedding-3-small"
         )
-        ad_structured_output.description_embeddings = embedding
-    finally:
-        return ad_structured_output
+    except RateLimitError as error:
+        await wait_out_rate_limit(error)
+        raise  # Re-raise the exception to trigger a retry
 
 
-def push_to_supabase(ad_structured_output: AdStructuredOutput | None):
-    if ad_structured_output is None:
+async def embed_descriptions(ad_structured_outputs: list[AdStructuredOutput]):
+    try:
+        response = await request_embeddings(
+            [ad.image_description for ad in ad_structured_outputs]
+        )
+    except BadRequestError as e:
+        if len(ad_structured_outputs) == 1:
+            print(f"Error creating embedding for ad {ad_structured_outputs[0].id}: {e}")
+            return
+
+        # One rejected description fails the whole request and is never retried,
+        # so split the batch until it is isolated and the rest still get embedded
+        middle = len(ad_structured_outputs) // 2
+        await embed_descriptions(ad_structured_outputs[:middle])
+        await embed_descriptions(ad_structured_outputs[middle:])
         return
 
-    if ad_structured_output.description_embeddings is None:
-        print("No embedding found for ad", ad_structured_output.id)
+    for embedding in response.data:
+        ad_structured_outputs[embedding.index].description_embeddings = np.asarray(
+            embedding.embedding, dtype=np.float32
+        )
+
+
+async def create_embeddings(
+    ad_structured_outputs: list[AdStructuredOutput], semaphore: asyncio.Semaphore
+) -> list[AdStructuredOutput] | None:
+    async with semaphore:
+        try:
+            await embed_descriptions(ad_structured_outputs)
+        except Exception as e:
+            print(f"Error creating embeddings for batch: {e}")
+            return None
+    return ad_structured_outputs
+
+
+def push_to_supabase(ad_structured_outputs: list[AdStructuredOutput] | None):
+    if not ad_structured_outputs:
+        return
+
+    for ad_structured_output in ad_structured_outputs:
+        if ad_structured_output.description_embeddings is None:
+            print("No embedding found for ad", ad_structured_output.id)
 
     supabase_client = get_supabase_client()
 
     supabase_client.table("ad_structured_output").upsert(
-        ad_structured_output.model_dump(mode="json")
+        [
+            ad_structured_output.model_dump(mode="json")
+            for ad_structured_output in ad_structured_outputs
+        ]
     ).execute()
 
 
-if __name__ == "__main__":
+async def main():
     supabase_client = get_supabase_client()
-    raw_ad_data = (
-        supabase_client.table("ad_structured_output").select("*").execute().data
+    raw_ad_data = await asyncio.to_thread(
+        lambda: supabase_client.table("ad_structured_output").select("*").execute().data
     )
     ads: list[AdStructuredOutput] = list(
         map(lambda ad: AdStructuredOutput.model_validate(ad), raw_ad_data)
     )
+    # The embeddings endpoint rejects empty input, so skip those ads up front
+    ads = [ad for ad in ads if ad.image_description.strip()]
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    tasks = [
+        create_embeddings(ads[i : i + BATCH_SIZE], semaphore)
+        for i in range(0, len(ads), BATCH_SIZE)
+    ]
 
     with tqdm(total=len(ads), desc="Creating embeddings") as pbar:
+        for task in asyncio.as_completed(tasks):
+            batch = await task
+            if batch is None:
+                continue
+            await asyncio.to_thread(push_to_supabase, batch)
+            pbar.update(len(batch))
 
-        def update_pbar(ad: AdStructuredOutput | None):
-            push_to_supabase(ad)
-            pbar.update(1)
 
-        with mp.Pool(4) as pool:
-            for ad in ads:
-                pool.apply_async(create_embedding, args=(ad,), callback=update_pbar)
-            pool.close()
-            pool.join()
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,10 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from models import GoogleAd
 from tqdm import tqdm
 from tenacity import (
@@ -8,7 +14,16 @@ from tenacity import (
     retry_if_exception_type,
 )
 
-from helpers import get_ad_data_from_db, get_supabase_client
+from helpers import get_ad_data_from_db, get_existing_image_urls_from_db
+
+MAX_WORKERS = 8
+
+# Shared session so concurrent workers reuse keep-alive connections to the API
+session = requests.Session()
+session.mount(
+    "http://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+)
+session.headers.update({"Connection": "keep-alive", "Content-Type": "application/json"})
 
 
 @retry(
@@ -19,9 +34,9 @@ from helpers import get_ad_data_from_db, get_supabase_client
 )
 def evaluate_ad(ad: GoogleAd):
     try:
-        response = requests.post(
+        response = session.post(
             "http://localhost:3000/api/evaluate",
-            json={"imageUrl": ad.image_url, "saveToDatabase": True},
+            data=orjson.dumps({"imageUrl": ad.image_url, "saveToDatabase": True}),
         )
         response.raise_for_status()
         return True
@@ -29,29 +44,31 @@ def evaluate_ad(ad: GoogleAd):
         print(f"Error evaluating ad: {e}")
         raise  # Re-raise the exception to trigger a retry
 
+
+def process_ad(ad: GoogleAd) -> str:
+    # Small startup jitter so the workers don't hit the backend in lockstep
+    time.sleep(random.uniform(0, 0.05))
+    return "successful" if evaluate_ad(ad) else "failed"
+
+
 def evaluate_ads(ads: list[GoogleAd]):
     total = len(ads)
     success_bar = tqdm(total=total, desc="Successful", position=0)
     fail_bar = tqdm(total=total, desc="Failed", position=1)
     skip_bar = tqdm(total=total, desc="Skipped", position=2)
-    supabase_client = get_supabase_client()
+    bars = {"successful": success_bar, "failed": fail_bar, "skipped": skip_bar}
+    existing_urls = get_existing_image_urls_from_db()
+    pending: list[GoogleAd] = []
     for ad in ads:
-        if (
-            ad.image_url is None
-            or len(
-                supabase_client.table("ad_structured_output")
-                .select("*")
-                .eq("image_url", ad.image_url)
-                .execute()
-                .data
-            )
-            > 0
-        ):
+        if ad.image_url is None or ad.image_url in existing_urls:
             skip_bar.update(1)
-        elif evaluate_ad(ad):
-            success_bar.update(1)
         else:
-            fail_bar.update(1)
+            pending.append(ad)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(process_ad, ad) for ad in pending]
+        for future in as_completed(futures):
+            bars[future.result()].update(1)
 
     successful = success_bar.n
     failed = fail_bar.n
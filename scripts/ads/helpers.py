@@ -1,33 +1,42 @@
-from collections import defaultdict
 import os
-from typing import Any, Generator
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
 from dotenv import load_dotenv
-from pydantic import UUID4
-from selenium import webdriver
-from selenium.webdriver.remote.webdriver import WebDriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
+import pandas as pd
+from pydantic import TypeAdapter
 
 import supabase
-from tqdm import tqdm
 
 from models import (
     AdAnalysis,
-    AdMetric,
     AdStructuredOutput,
-    Feature,
     GoogleAd,
     JoinedFeatureMetric,
-    SentimentAnalysis,
-    VisualAttribute,
 )
 
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
+
 
 load_dotenv(".env.local")
 
+# Rows from Supabase are already typed by Postgres, so flat models are built with
+# model_construct; nested analyses still need validation to hydrate sub-models,
+# and structured outputs to parse their pgvector embeddings into arrays.
+ad_analyses_adapter = TypeAdapter(list[AdAnalysis])
+ad_structured_outputs_adapter = TypeAdapter(list[AdStructuredOutput])
+
+
+def create_driver(headless: bool = True) -> "WebDriver":
+    # Selenium is only needed by the scrapers, so keep it out of every other import
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+    from webdriver_manager.chrome import ChromeDriverManager
 
-def create_driver(headless: bool = True) -> WebDriver:
     chrome_options = Options()
     if headless:
         chrome_options.add_argument("--headless")
@@ -37,6 +46,7 @@ def create_driver(headless: bool = True) -> WebDriver:
     return driver
 
 
+@lru_cache(maxsize=1)
 def get_supabase_client():
     return supabase.create_client(
         os.getenv("NEXT_PUBLIC_SUPABASE_URL"),
@@ -44,122 +54,116 @@ def get_supabase_client():
     )
 
 
-def get_ad_data_from_db() -> list[GoogleAd]:
+def fetch_all_rows(
+    table: str,
+    columns: str = "*",
+    order_column: str = "id",
+    batch_size: int = 1000,
+    max_workers: int = 6,
+) -> list[dict[str, Any]]:
     supabase_client = get_supabase_client()
-    offset, batch_size = 0, 1000
-    ads: list[GoogleAd] = []
-    while True:
-        new_ads: list[GoogleAd] = [
-            GoogleAd.model_validate(ad)
-            for ad in supabase_client.table("google_image_ads")
-            .select("*")
-            .range(offset, offset + batch_size)
+
+    # Every page is ordered on a unique column, since separate range queries
+    # without ORDER BY can overlap or skip rows
+    def fetch_page(offset: int) -> list[dict[str, Any]]:
+        return (
+            supabase_client.table(table)
+            .select(columns)
+            .order(order_column)
+            .range(offset, offset + batch_size - 1)
             .execute()
             .data
-        ]
-        ads.extend(new_ads)
-        if len(new_ads) < batch_size:
-            break
-        offset += batch_size
-    return ads
+        )
+
+    # The first page also reports the total row count, so the remaining page
+    # offsets are known up front and can be fetched concurrently
+    first_page = (
+        supabase_client.table(table)
+        .select(columns, count="exact")
+        .order(order_column)
+        .range(0, batch_size - 1)
+        .execute()
+    )
+    rows: list[dict[str, Any]] = list(first_page.data)
+    offsets = range(batch_size, first_page.count or 0, batch_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for page in executor.map(fetch_page, offsets):
+            rows.extend(page)
+    return rows
+
+
+def get_ad_data_from_db() -> list[GoogleAd]:
+    # google_image_ads is keyed on advertisement_url and has no id column
+    return [
+        GoogleAd.model_construct(**ad)
+        for ad in fetch_all_rows("google_image_ads", order_column="advertisement_url")
+    ]
 
 
 def get_ad_structured_outputs_from_db() -> list[AdStructuredOutput]:
-    supabase_client = get_supabase_client()
-    offset, batch_size = 0, 1000
-    analyses: list[AdStructuredOutput] = []
-    while True:
-        new_analyses: list[AdStructuredOutput] = [
-            AdStructuredOutput.model_validate(analysis)
-            for analysis in supabase_client.table("ad_structured_output")
-            .select("*")
-            .range(offset, offset + batch_size)
-            .execute()
-            .data
-        ]
-        analyses.extend(new_analyses)
-        if len(new_analyses) < batch_size:
-            break
-        offset += batch_size
-    return analyses
+    return ad_structured_outputs_adapter.validate_python(
+        fetch_all_rows("ad_structured_output")
+    )
 
 
-def get_ad_analyses_from_db() -> list[AdAnalysis]:
-    supabase_client = get_supabase_client()
-    offset, batch_size = 0, 1000
-    analyses: list[AdAnalysis] = []
-    while True:
-        raw_analyses: list[dict[str, Any]] = (
-            supabase_client.table("ad_structured_output")
-            .select(
-                "id, image_description, image_url, features(id, ad_output_id, keyword, confidence_score, category, location, visual_attributes(id, feature_id, attribute, value)), sentiment_analysis(id, ad_output_id, tone, confidence)"
-            )
-            .range(offset, offset + batch_size)
-            .execute()
-            .data
+def get_existing_image_urls_from_db() -> set[str]:
+    return {
+        row["image_url"] for row in fetch_all_rows("ad_structured_output", "image_url")
+    }
+
+
+def get_ad_analyses_checksum() -> str:
+    # One RPC hashing the ids of every table behind an analysis; ids are random
+    # UUIDs, so replaced rows change it even when the row counts stay the same
+    return get_supabase_client().rpc("ad_analyses_checksum").execute().data
+
+
+@cache
+def get_ad_analyses_from_db(
+    cache_file: str = "ad_analyses.pkl", refresh: bool = False
+) -> list[AdAnalysis]:
+    # The checksum is a cheap staleness check before re-running the embedded
+    # select; in-place edits keep their ids, so pass refresh=True after those.
+    # A refresh drops the cache file, and the next regular call rebuilds it
+    cache_path = Path(cache_file)
+    cache_key = None
+    if refresh:
+        cache_path.unlink(missing_ok=True)
+    else:
+        cache_key = get_ad_analyses_checksum()
+        if cache_path.exists():
+            with cache_path.open("rb") as f:
+                cached_key, analyses = pickle.load(f)
+            if cached_key == cache_key:
+                return analyses
+
+    analyses: list[AdAnalysis] = ad_analyses_adapter.validate_python(
+        fetch_all_rows(
+            "ad_structured_output",
+            "id, image_description, image_url, features(id, ad_output_id, keyword, confidence_score, category, location, visual_attributes(id, feature_id, attribute, value)), sentiment_analysis(id, ad_output_id, tone, confidence)",
         )
-        new_analyses: list[AdAnalysis] = [
-            AdAnalysis.model_validate(analysis) for analysis in raw_analyses
-        ]
-        analyses.extend(new_analyses)
-        if len(new_analyses) < batch_size:
-            break
-        offset += batch_size
+    )
+    if cache_key is not None:
+        with cache_path.open("wb") as f:
+            pickle.dump((cache_key, analyses), f, protocol=5)
     return analyses
 
 
-def get_features_and_metrics_from_db() -> list[JoinedFeatureMetric]:
-    supabase_client = get_supabase_client()
-    offset, batch_size = 0, 1000
-    features: list[Feature] = []
-    metrics: list[AdMetric] = []
-    while True:
-        new_features: list[Feature] = [
-            Feature.model_validate(feature)
-            for feature in supabase_client.table("features")
-            .select("*")
-            .range(offset, offset + batch_size)
-            .execute()
-            .data
-        ]
-        features.extend(new_features)
-        if len(new_features) < batch_size:
-            break
-        offset += batch_size
-    offset = 0
-    while True:
-        new_metrics: list[AdMetric] = [
-            AdMetric.model_validate(metric)
-            for metric in supabase_client.table("ad_metrics")
-            .select("*")
-            .range(offset, offset + batch_size)
-            .execute()
-            .data
-        ]
-        metrics.extend(new_metrics)
-        if len(new_metrics) < batch_size:
-            break
-        offset += batch_size
-
-    print(len(features), len(metrics))
-
-    grouped_features: dict[UUID4, list[Feature]] = defaultdict(list)
-    for feature in features:
-        grouped_features[feature.ad_output_id].append(feature)
-
-    joined_features: list[JoinedFeatureMetric] = []
-    for metric in metrics:
-        for feature in grouped_features[metric.ad_id]:
-            joined_features.append(
-                JoinedFeatureMetric(
-                    ad_output_id=metric.ad_id,
-                    clicks=metric.clicks,
-                    impressions=metric.impressions,
-                    ctr=metric.ctr,
-                    keyword=feature.keyword,
-                    confidence_score=feature.confidence_score,
-                    category=feature.category,
-                    location=feature.location,
-                )
-            )
+def get_features_and_metrics_from_db() -> pd.DataFrame:
+    # Let PostgREST join metrics and features through their shared ad
+    raw_ads = fetch_all_rows(
+        "ad_structured_output",
+        "id, ad_metrics!inner(impressions, clicks, ctr), features!inner(keyword, confidence_score, category, location)",
+    )
+    columns = list(JoinedFeatureMetric.model_fields)
+    if not raw_ads:
+        return pd.DataFrame(columns=columns)
+
+    metrics = pd.json_normalize(raw_ads, record_path="ad_metrics", meta="id")
+    features = pd.json_normalize(raw_ads, record_path="features", meta="id")
+    joined_features = metrics.merge(features, on="id").rename(
+        columns={"id": "ad_output_id"}
+    )[columns]
+
+    print(len(joined_features))
     return joined_features
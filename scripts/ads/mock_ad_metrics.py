@@ -1,87 +1,115 @@
-import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from tqdm import tqdm
-from models import AdAnalysis, AdMetric
+from models import AdAnalysis
 from helpers import (
     get_ad_analyses_from_db,
     get_supabase_client,
 )
 
-
-async def mock_ad_metric(ad_analysis: AdAnalysis):
-    supabase_client = get_supabase_client()
-
-    # Define combined category-location multipliers
-    category_location_multipliers = {
-        "emotion": {"top-center": 3.5, "middle-center": 3.0, "bottom-center": 2.5},
-        "product": {"middle-center": 4.0, "top-center": 3.2, "middle-right": 2.8},
-        "brand": {"top-left": 3.2, "top-right": 3.2, "top-center": 3.5},
-        "person": {"middle-right": 4.5, "middle-left": 4.0, "middle-center": 3.5},
-        "setting": {"top-center": 2.8, "middle-center": 3.2, "bottom-center": 2.5},
-        "text": {"top-center": 2.8, "middle-center": 2.5, "bottom-center": 2.2},
-        "call-to-action": {"bottom-center": 4.5, "top-left": 3.5, "bottom-right": 3.2},
-    }
-
-    # Calculate combined multiplier based on all features
-    combined_multiplier = 1.0
-    feature_count = 0
-
-    for feature in ad_analysis.features:
-        category = (
-            feature.category
-            if feature.category in category_location_multipliers
-            else "text"
-        )
-        location = feature.location
-
-        # Get the multiplier for the category-location combination
-        if location in category_location_multipliers[category]:
-            feature_multiplier = category_location_multipliers[category][location]
-        else:
-            # Default multiplier if the specific location is not defined for the category
-            feature_multiplier = 0.2
-
-        combined_multiplier *= feature_multiplier
-        feature_count += 1
-
-    # Apply root to normalize the combined multiplier
-    if feature_count > 0:
-        combined_multiplier = combined_multiplier ** (1 / feature_count)
+# Number of metric rows sent per upsert
+BATCH_SIZE = 500
+MAX_WORKERS = 8
+
+rng = np.random.default_rng()
+
+# Define combined category-location multipliers
+CATEGORY_LOCATION_MULTIPLIERS = {
+    "emotion": {"top-center": 3.5, "middle-center": 3.0, "bottom-center": 2.5},
+    "product": {"middle-center": 4.0, "top-center": 3.2, "middle-right": 2.8},
+    "brand": {"top-left": 3.2, "top-right": 3.2, "top-center": 3.5},
+    "person": {"middle-right": 4.5, "middle-left": 4.0, "middle-center": 3.5},
+    "setting": {"top-center": 2.8, "middle-center": 3.2, "bottom-center": 2.5},
+    "text": {"top-center": 2.8, "middle-center": 2.5, "bottom-center": 2.2},
+    "call-to-action": {"bottom-center": 4.5, "top-left": 3.5, "bottom-right": 3.2},
+}
+
+
+# Log of every category-location multiplier, so a geometric mean is a plain average
+LOG_MULTIPLIERS = {
+    (category, location): np.log(multiplier)
+    for category, locations in CATEGORY_LOCATION_MULTIPLIERS.items()
+    for location, multiplier in locations.items()
+}
+# Default multiplier if the specific location is not defined for the category
+DEFAULT_LOG_MULTIPLIER = np.log(0.2)
+
+
+def get_combined_multipliers(ad_analyses: list[AdAnalysis]) -> np.ndarray:
+    # Flatten every feature into (ad index, log multiplier) pairs
+    ad_indices: list[int] = []
+    log_multipliers: list[float] = []
+    for i, ad_analysis in enumerate(ad_analyses):
+        for feature in ad_analysis.features or []:
+            category = (
+                feature.category
+                if feature.category in CATEGORY_LOCATION_MULTIPLIERS
+                else "text"
+            )
+            ad_indices.append(i)
+            log_multipliers.append(
+                LOG_MULTIPLIERS.get(
+                    (category, feature.location), DEFAULT_LOG_MULTIPLIER
+                )
+            )
+
+    # Apply root to normalize the combined multiplier: the nth root of a product is
+    # the exp of the mean log. Ads without features keep a multiplier of 1.0.
+    indices = np.asarray(ad_indices, dtype=np.intp)
+    feature_counts = np.bincount(indices, minlength=len(ad_analyses))
+    log_sums = np.bincount(indices, weights=log_multipliers, minlength=len(ad_analyses))
+    return np.exp(log_sums / np.maximum(feature_counts, 1))
+
+
+def mock_ad_metrics(ad_analyses: list[AdAnalysis]) -> list[dict]:
+    combined_multipliers = get_combined_multipliers(ad_analyses)
 
     # Generate impressions using Poisson distribution
     base_impressions = 1000
-    adjusted_impressions = base_impressions * combined_multiplier
-    impressions = np.random.poisson(lam=adjusted_impressions)
+    adjusted_impressions = base_impressions * combined_multipliers
+    impressions = rng.poisson(lam=adjusted_impressions)
 
     # Generate clicks using Binomial distribution with adjusted CTR
     base_ctr = 0.03
-    adjusted_ctr = base_ctr * combined_multiplier
-    clicks = np.random.binomial(n=impressions, p=adjusted_ctr)
+    adjusted_ctr = base_ctr * combined_multipliers
+    clicks = rng.binomial(n=impressions, p=adjusted_ctr)
 
     # Ensure clicks don't exceed impressions (just in case)
-    clicks = min(clicks, impressions)
-
-    metric = AdMetric(ad_id=ad_analysis.id, impressions=impressions, clicks=clicks)
-    dict_metric = {
-        k: v for k, v in metric.model_dump(mode="json").items() if v is not None
-    }
+    clicks = np.minimum(clicks, impressions)
+
+    # Rows are built directly in AdMetric's JSON shape with ctr left unset: ids come
+    # from the database and the draws are non-negative ints, so validation is moot
+    return [
+        {
+            "ad_id": str(ad_analysis.id),
+            "impressions": ad_impressions,
+            "clicks": ad_clicks,
+        }
+        for ad_analysis, ad_impressions, ad_clicks in zip(
+            ad_analyses, impressions.tolist(), clicks.tolist()
+        )
+    ]
 
-    # Use asyncio.to_thread for the database operation
-    await asyncio.to_thread(
-        lambda: supabase_client.table("ad_metrics").upsert(dict_metric).execute()
-    )
 
+def upload_metrics(metrics: list[dict]):
+    get_supabase_client().table("ad_metrics").upsert(metrics).execute()
 
-async def main():
-    ad_analyses = await asyncio.to_thread(get_ad_analyses_from_db)
 
-    tasks = [mock_ad_metric(ad_analysis) for ad_analysis in ad_analyses]
+def main(refresh: bool = False):
+    ad_analyses = get_ad_analyses_from_db(refresh=refresh)
+    metrics = mock_ad_metrics(ad_analyses)
 
-    for task in tqdm(
-        asyncio.as_completed(tasks), total=len(tasks), desc="Mocking ad metrics"
-    ):
-        await task
+    batch_starts = range(0, len(metrics), BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        uploads = executor.map(
+            upload_metrics, (metrics[i : i + BATCH_SIZE] for i in batch_starts)
+        )
+        for _ in tqdm(uploads, total=len(batch_starts), desc="Uploading ad metrics"):
+            pass
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # --refresh ignores the on-disk analyses cache, e.g. after in-place edits
+    main(refresh="--refresh" in sys.argv[1:])
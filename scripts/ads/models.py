@@ -1,6 +1,30 @@
-from pydantic import BaseModel, UUID4, Field
+import json
+import numpy as np
+from pydantic import (
+    BaseModel,
+    BeforeValidator,
+    ConfigDict,
+    PlainSerializer,
+    UUID4,
+    Field,
+)
 from datetime import date
-from typing import List, Literal
+from typing import Annotated, List, Literal
+
+
+def to_embedding_array(value) -> np.ndarray:
+    # pgvector columns come back from PostgREST as "[0.1,0.2,...]" strings
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+# float32 array in memory, plain list of floats when dumped to JSON
+Embedding = Annotated[
+    np.ndarray,
+    BeforeValidator(to_embedding_array),
+    PlainSerializer(lambda value: value.tolist(), return_type=list[float]),
+]
 
 
 class GoogleAd(BaseModel):
@@ -12,10 +36,12 @@ class GoogleAd(BaseModel):
 
 
 class AdStructuredOutput(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     id: UUID4 = Field(default_factory=UUID4)
     image_url: str
     image_description: str
-    description_embeddings: list[float] | None = None
+    description_embeddings: Embedding | None = None
 
 
 class SentimentAnalysis(BaseModel):
@@ -1,26 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 from tqdm import tqdm
 from datetime import datetime
-import json
-import os
-import time
-from typing import Any
 from dotenv import load_dotenv
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.remote.webdriver import WebDriver
-from selenium.webdriver.remote.webelement import WebElement
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-import re
-from urllib.parse import urlparse
-import traceback
-import multiprocessing as mp
-
-import supabase
 
 from models import GoogleAd
 from helpers import get_supabase_client, create_driver, get_ad_data_from_db
@@ -28,6 +14,10 @@ from helpers import get_supabase_client, create_driver, get_ad_data_from_db
 # Load environment variables
 load_dotenv(".env.local")
 
+# CSS class selectors hit the browser's fast matching path, unlike contains() XPath
+ADVERTISER_LINK = (By.CSS_SELECTOR, ".advertiser-header-link")
+LAST_SHOWN = (By.CSS_SELECTOR, ".region-last-shown")
+
 
 def scrape_ad_links(url: str, limit: int = 1000, headless: bool = True):
     # Open the website
@@ -37,6 +27,8 @@ def scrape_ad_links(url: str, limit: int = 1000, headless: bool = True):
 
     driver.get(url)
     all_links: list[str] = []
+    # Links already written, so each scroll only upserts the newly loaded cards
+    upserted_urls: set[str] = set()
 
     driver.get(url)
     WebDriverWait(driver, 10).until(
@@ -56,12 +48,19 @@ def scrape_ad_links(url: str, limit: int = 1000, headless: bool = True):
                 )
             )
 
+            new_links = [
+                link
+                for link in all_links
+                if link["advertisement_url"] not in upserted_urls
+            ]
+
             batch_size = 500
-            for i in range(0, len(all_links), batch_size):
-                batch = all_links[i : i + batch_size]
+            for i in range(0, len(new_links), batch_size):
+                batch = new_links[i : i + batch_size]
                 supabase_client.table("google_image_ads").upsert(batch).execute()
+            upserted_urls.update(link["advertisement_url"] for link in new_links)
 
-            print("Upserted", len(all_links), "links")
+            print("Upserted", len(new_links), "new links")
 
             driver.execute_script(
                 "window.scrollBy(0, document.body.scrollHeight);"
@@ -92,24 +91,16 @@ def parse_ad_data(ad: GoogleAd, driver: WebDriver) -> GoogleAd | None:
     for _ in range(3):
         try:
             driver.get(ad.advertisement_url)
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located(
-                    (By.CLASS_NAME, "advertiser-header-link")
-                )
+            advertiser_name_element = WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located(ADVERTISER_LINK)
             )
 
             ad_data: GoogleAd = ad
 
-            advertiser_name_element = driver.find_element(
-                By.CLASS_NAME, "advertiser-header-link"
-            )
-
             ad_data.advertiser_name = advertiser_name_element.text.strip()
             ad_data.advertiser_url = advertiser_name_element.get_attribute("href")
 
-            last_shown_element = driver.find_element(
-                By.XPATH, "//*[contains(@class, 'region-last-shown')]"
-            )
+            last_shown_element = driver.find_element(*LAST_SHOWN)
             ad_data.last_shown = datetime.strptime(
                 last_shown_element.text.split(":")[1].strip(), "%b %d, %Y"
             ).date()
@@ -125,9 +116,10 @@ def parse_ad_data(ad: GoogleAd, driver: WebDriver) -> GoogleAd | None:
             #     EC.presence_of_element_located((By.ID, "marketing-image"))
             # )
 
-            WebDriverWait(driver, 3).until(wait_for_image_ad_to_render)
-
-            ad_data.image_url = wait_for_image_ad_to_render(driver)
+            # until() returns the image URL itself, so the iframes are walked once
+            ad_data.image_url = WebDriverWait(driver, 3).until(
+                wait_for_image_ad_to_render
+            )
 
             if ad_data.image_url:
                 return ad_data
@@ -138,7 +130,20 @@ def parse_ad_data(ad: GoogleAd, driver: WebDriver) -> GoogleAd | None:
     return ad_data
 
 
+def parse_ad_data_with_pool(ad: GoogleAd, drivers: Queue[WebDriver]) -> GoogleAd | None:
+    # Borrow an idle browser for this ad and hand it back once parsing finishes
+    driver = drivers.get()
+    try:
+        return parse_ad_data(ad, driver)
+    finally:
+        drivers.put(driver)
+
+
 SCRAPE_LINKS = False
+# Number of Chrome instances parsing ads in parallel
+NUM_DRIVERS = 4
+# Number of parsed ads written per upsert
+PARSED_ADS_BATCH_SIZE = 50
 
 if __name__ == "__main__":
     if SCRAPE_LINKS:
@@ -149,7 +154,9 @@ if __name__ == "__main__":
         )
     else:
 
-        driver = create_driver(headless=False)
+        drivers: Queue[WebDriver] = Queue()
+        for _ in range(NUM_DRIVERS):
+            drivers.put(create_driver(headless=False))
         supabase_client = get_supabase_client()
         ads = get_ad_data_from_db()
 
@@ -157,15 +164,29 @@ if __name__ == "__main__":
         success_pbar = tqdm(total=total_ads, desc="Successful", position=0)
         fail_pbar = tqdm(total=total_ads, desc="Failed", position=1)
 
-        for ad in tqdm(ads, desc="Parsing ads", position=2):
-            parsed_ad = parse_ad_data(ad, driver)
-            if parsed_ad and parsed_ad.image_url:
-                supabase_client.table("google_image_ads").upsert(
-                    parsed_ad.model_dump(mode="json")
-                ).execute()
-                success_pbar.update(1)
-            else:
-                fail_pbar.update(1)
+        parsed_ads: list[dict] = []
+        with ThreadPoolExecutor(max_workers=NUM_DRIVERS) as executor:
+            results = executor.map(lambda ad: parse_ad_data_with_pool(ad, drivers), ads)
+            for parsed_ad in tqdm(
+                results, total=total_ads, desc="Parsing ads", position=2
+            ):
+                if parsed_ad and parsed_ad.image_url:
+                    parsed_ads.append(parsed_ad.model_dump(mode="json"))
+                    success_pbar.update(1)
+                else:
+                    fail_pbar.update(1)
+
+                if len(parsed_ads) >= PARSED_ADS_BATCH_SIZE:
+                    supabase_client.table("google_image_ads").upsert(
+                        parsed_ads
+                    ).execute()
+                    parsed_ads = []
+
+        if parsed_ads:
+            supabase_client.table("google_image_ads").upsert(parsed_ads).execute()
 
         success_pbar.close()
         fail_pbar.close()
+
+        while not drivers.empty():
+            drivers.get().quit()
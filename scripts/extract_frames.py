@@ -1,13 +1,12 @@
 import sys
 import json
+import shutil
 import tempfile
 import requests
 import numpy as np
 from urllib.parse import urlparse
 from pathlib import Path
 import base64
-from io import BytesIO
-from PIL import Image
 
 # Add these environment variables before cv2 import
 import os
@@ -16,36 +15,43 @@ os.environ["OPENCV_VIDEOIO_PRIORITY_GSTREAMER"] = "0"
 
 import cv2
 
-def compress_image_base64(image_array, quality=85, max_size=(1920, 1080)):
+# Frames go to a vision model that gains nothing past ~1024px, so keep them small
+def compress_image_base64(image_array, quality=75, max_size=(1024, 1024)):
     """Compress image and convert to base64"""
-    # Convert CV2 image to PIL
-    image = Image.fromarray(cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB))
-    
     # Resize if larger than max_size while maintaining aspect ratio
-    if image.size[0] > max_size[0] or image.size[1] > max_size[1]:
-        image.thumbnail(max_size, Image.Resampling.LANCZOS)
-    
-    # Save to buffer with compression
-    buffer = BytesIO()
-    image.save(buffer, format="JPEG", quality=quality, optimize=True)
-    
+    height, width = image_array.shape[:2]
+    scale = min(max_size[0] / width, max_size[1] / height)
+    if scale < 1:
+        image_array = cv2.resize(
+            image_array,
+            (int(width * scale), int(height * scale)),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    # Encode straight from the BGR frame with compression
+    ok, buffer = cv2.imencode('.jpg', image_array, [
+        cv2.IMWRITE_JPEG_QUALITY, quality,
+        cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+    ])
+    if not ok:
+        raise Exception("Failed to encode frame as JPEG")
+
     # Convert to base64
-    base64_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    base64_image = base64.b64encode(buffer).decode('utf-8')
     return f'data:image/jpeg;base64,{base64_image}'
 
 def download_video(url: str) -> str:
     """Download video to a temporary file and return the path"""
     try:
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        with open(temp_file.name, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        
+        # Connect and per-read timeouts keep a stalled server from hanging the daemon
+        with requests.get(url, stream=True, timeout=(10, 60)) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+
+            # Copy the raw stream straight into the temp file in 1 MiB reads
+            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
+                shutil.copyfileobj(response.raw, temp_file, length=1 << 20)
+
         return temp_file.name
     except Exception as e:
         raise Exception(f"Failed to download video: {str(e)}")
@@ -69,37 +75,31 @@ def extract_frames(video_url: str) -> dict:
         if fps <= 0:
             fps = 30
 
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = total_frames / fps if fps > 0 else 0
-
-        if duration <= 0:
-            frame_count = 0
-            while cap.grab():
-                frame_count += 1
-            duration = frame_count / fps
-            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-
         frames = []
         frame_interval = 5  # Extract frame every 5 seconds for more detailed analysis
-        current_sec = 0
-
-        while current_sec < duration:
-            frame_pos = int(current_sec * fps)
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
-            
-            ret, frame = cap.read()
-            if ret:
-                try:
-                    # Compress and convert frame to base64
-                    base64_frame = compress_image_base64(frame)
-                    frames.append({
-                        'timestamp': current_sec,
-                        'data': base64_frame
-                    })
-                except Exception as e:
-                    print(f"Warning: Failed to process frame at {current_sec}s: {str(e)}", file=sys.stderr)
-            
-            current_sec += frame_interval
+        frame_step = max(1, round(fps * frame_interval))
+
+        # Walk the video once instead of seeking per sample: grab() only advances,
+        # retrieve() converts just the sampled frames, and the same pass counts
+        # frames so videos without a usable frame count need no second read
+        frame_index = 0
+        while cap.grab():
+            if frame_index % frame_step == 0:
+                current_sec = frame_index // frame_step * frame_interval
+                ret, frame = cap.retrieve()
+                if ret:
+                    try:
+                        # Compress and convert frame to base64
+                        base64_frame = compress_image_base64(frame)
+                        frames.append({
+                            'timestamp': current_sec,
+                            'data': base64_frame
+                        })
+                    except Exception as e:
+                        print(f"Warning: Failed to process frame at {current_sec}s: {str(e)}", file=sys.stderr)
+            frame_index += 1
+
+        duration = frame_index / fps
 
         return {
             'success': True,
@@ -122,7 +122,26 @@ def extract_frames(video_url: str) -> dict:
             except:
                 pass
 
+def serve():
+    """Extract frames for one JSON-encoded video URL per stdin line, answering each with one JSON line"""
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            result = extract_frames(json.loads(line))
+        except Exception as e:
+            result = {
+                'success': False,
+                'error': str(e)
+            }
+        sys.stdout.write(json.dumps(result) + '\n')
+        sys.stdout.flush()
+
 if __name__ == "__main__":
+    if sys.argv[1:] == ['--daemon']:
+        serve()
+        sys.exit(0)
+
     if len(sys.argv) != 2:
         print(json.dumps({'success': False, 'error': 'Video URL required'}))
         sys.exit(1)
@@ -12,6 +12,28 @@ dotenv.load_dotenv("../.env.local")
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+# Searches sent to Brave at once by brave_web_search_many
+MAX_CONCURRENT_SEARCHES = 8
+
+# Shared across searches so connections are kept alive between queries
+session: aiohttp.ClientSession | None = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the shared session, creating it on first use"""
+    global session
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64, ttl_dns_cache=300)
+        )
+    return session
+
+
+async def close_session() -> None:
+    """Close the shared session once searching is finished"""
+    if session is not None and not session.closed:
+        await session.close()
+
 
 async def brave_web_search(query: str, count: int = 5) -> BraveWebSearchResponse:
     """
@@ -35,24 +57,45 @@ async def brave_web_search(query: str, count: int = 5) -> BraveWebSearchResponse
     url = f"https://api.search.brave.com/res/v1/web/search?{urlencode(params)}"
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                headers={"Accept": "application/json", "X-Subscription-Token": api_key},
-            ) as response:
-                if not response.ok:
-                    raise ValueError(
-                        f"Brave Search API error: {response.status} {response.reason}"
-                    )
-
-                data = await response.json()
-                return BraveWebSearchResponse.model_validate(data)
+        async with get_session().get(
+            url,
+            headers={"Accept": "application/json", "X-Subscription-Token": api_key},
+        ) as response:
+            if not response.ok:
+                raise ValueError(
+                    f"Brave Search API error: {response.status} {response.reason}"
+                )
+
+            data = await response.json()
+            return BraveWebSearchResponse.model_validate(data)
 
     except Exception as error:
         logging.error("Error in brave web search: %s", error)
         raise
 
 
+async def brave_web_search_many(
+    queries: list[str], count: int = 5
+) -> list[BraveWebSearchResponse]:
+    """
+    Runs several Brave web searches concurrently
+
+    Args:
+        queries: The search query strings
+        count: Number of results to return per query (default: 5)
+
+    Returns:
+        BraveWebSearchResponse for each query, in the same order as queries
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+
+    async def search(query: str) -> BraveWebSearchResponse:
+        async with semaphore:
+            return await brave_web_search(query, count)
+
+    return await asyncio.gather(*(search(query) for query in queries))
+
+
 if __name__ == "__main__":
 
     async def main():
@@ -60,5 +103,6 @@ if __name__ == "__main__":
         web_results = await brave_web_search("women's running shoes", 10)
         print("Web Search Results:")
         print(web_results.model_dump_json(indent=2))
+        await close_session()
 
     asyncio.run(main())
@@ -1,10 +1,13 @@
-from functools import lru_cache
 import time
 import httpx
 from typing import Optional, Callable, Any, Union, Awaitable
 import asyncio
+from collections import OrderedDict
 from dataclasses import dataclass
-from bs4 import BeautifulSoup
+from selectolax.parser import HTMLParser
+
+# Number of extracted pages each worker keeps in memory
+CONTENT_CACHE_SIZE = 1000
 
 
 @dataclass
@@ -20,18 +23,53 @@ class BrowserWorker:
         self.queue: asyncio.Queue[WorkItem] = asyncio.Queue()
         self.running = True
         self.client = httpx.AsyncClient(
-            timeout=10.0,
+            timeout=httpx.Timeout(10.0, connect=5.0),
             follow_redirects=True,
+            # Pool limits and HTTP/2 are set on the transport, which also retries
+            # failed connection attempts before a request errors out
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=2,
+                limits=httpx.Limits(
+                    max_connections=256,
+                    max_keepalive_connections=64,
+                    keepalive_expiry=75.0,
+                ),
+            ),
             headers={
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
             },
         )
+        # Extracted content by URL, least recently used first
+        self.content_cache: OrderedDict[str, str] = OrderedDict()
+        # Fetches in flight, so concurrent requests for one URL share a download
+        self.pending: dict[str, asyncio.Task[Optional[str]]] = {}
 
     async def initialize(self):
         print(f"Worker {self.worker_id} initialized")
 
-    @lru_cache(maxsize=1000)
     async def extract_content(self, url: str) -> Optional[str]:
+        if url in self.content_cache:
+            self.content_cache.move_to_end(url)
+            return self.content_cache[url]
+        if url in self.pending:
+            return await self.pending[url]
+
+        fetch = asyncio.create_task(self._fetch_content(url))
+        self.pending[url] = fetch
+        try:
+            content = await fetch
+        finally:
+            del self.pending[url]
+
+        # Failures are not cached so the URL can be retried later
+        if content is not None:
+            self.content_cache[url] = content
+            if len(self.content_cache) > CONTENT_CACHE_SIZE:
+                self.content_cache.popitem(last=False)
+        return content
+
+    async def _fetch_content(self, url: str) -> Optional[str]:
         start_time = time.time()
         retries = 2
         try:
@@ -39,22 +77,22 @@ class BrowserWorker:
             response.raise_for_status()
 
             for attempt in range(retries):
-                # Parse with BeautifulSoup
-                soup = BeautifulSoup(response.text, "html.parser")
+                # Parse with selectolax's C parser straight from the raw bytes
+                tree = HTMLParser(response.content)
 
                 # Remove unwanted elements
-                for tag in soup(
-                    ["script", "style", "nav", "footer", "header", "iframe", "noscript"]
+                for tag in tree.css(
+                    "script, style, nav, footer, header, iframe, noscript"
                 ):
                     tag.decompose()
 
                 # Get main content
-                main = soup.find("main") or soup.find("article") or soup.find("body")
+                main = tree.css_first("main") or tree.css_first("article") or tree.body
                 if not main:
                     return None
 
                 # Extract text content
-                text = " ".join(main.stripped_strings)
+                text = main.text(separator=" ", strip=True)
                 if len(text.strip()) > 100:  # Check if we got meaningful content
                     return text
 
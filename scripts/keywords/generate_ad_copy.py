@@ -1,12 +1,11 @@
+import asyncio
 import os
 import time
 from typing import List, Optional, Tuple
-from openai import OpenAI
+from openai import AsyncOpenAI
 from helpers import get_supabase_client
 from models import ImprovedHeadlines, OriginalImageHeadlines
 import dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential
-from multiprocessing import Pool, cpu_count, Manager
 from tqdm import tqdm
 from prompts import (
     AD_COPY_GENERATION_PROMPT,
@@ -17,6 +16,36 @@ from prompts import (
 # Load environment variables
 dotenv.load_dotenv("../../.env.local")
 
+# The SDK is the only retry layer: it retries just the failed request on rate
+# limits, timeouts and server errors, backing off as the Retry-After header asks
+openai_client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"), max_retries=3, timeout=60.0
+)
+supabase_client = get_supabase_client()
+
+# Number of ads being sent through OpenAI at once
+MAX_CONCURRENT_REQUESTS = 16
+# Supabase caps responses at 1000 rows
+PAGE_SIZE = 1000
+
+
+def fetch_pending_research() -> list[dict]:
+    """Fetch the research columns needed for ads that have no new headlines yet"""
+    rows: list[dict] = []
+    while True:
+        page = (
+            supabase_client.table("market_research_v2")
+            .select("image_url, intent_summary, pain_points")
+            .is_("new_headlines", "null")
+            .order("id")
+            .range(len(rows), len(rows) + PAGE_SIZE - 1)
+            .execute()
+            .data
+        )
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+
 
 def update_database(results: dict) -> None:
     """Update database with results"""
@@ -24,8 +53,7 @@ def update_database(results: dict) -> None:
         return
 
     try:
-        supabase = get_supabase_client()
-        supabase.table("market_research_v2").update(
+        supabase_client.table("market_research_v2").update(
             {
                 "original_headlines": [
                     h.model_dump(mode="json") for h in results["original_headlines"]
@@ -39,15 +67,70 @@ def update_database(results: dict) -> None:
         print(f"Error updating database for {results['image_url']}: {e}")
 
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=4, max=15),
-)
-def process_and_update(
-    args: Tuple[str, Optional[List[str]], Optional[str], Optional[List[str]], dict]
+async def extract_headlines(image_url: str) -> OriginalImageHeadlines:
+    """Extract the original headlines from an ad image"""
+    completion = await openai_client.beta.chat.completions.parse(
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "system",
+                "content": HEADLINE_EXTRACTION_PROMPT,
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Generate compelling headlines for this ad that align with its visual elements and marketing goals.",
+                    },
+                    {"type": "image_url", "image_url": {"url": image_url}},
+                ],
+            },
+        ],
+        max_tokens=2048,
+        response_format=OriginalImageHeadlines,
+    )
+
+    original_headlines = completion.choices[0].message.parsed
+    if not original_headlines:
+        raise ValueError("No original headlines found")
+    return original_headlines
+
+
+async def improve_headlines(
+    original_headlines: OriginalImageHeadlines,
+    intent_summary: Optional[str],
+    pain_points: Optional[List[str]],
+) -> ImprovedHeadlines:
+    """Generate improved headlines from the original ones and market research"""
+    new_completion = await openai_client.beta.chat.completions.parse(
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "system",
+                "content": HEADLINE_IMPROVEMENT_PROMPT,
+            },
+            {
+                "role": "user",
+                "content": f"Original headlines: {original_headlines}\nIntent summary: {intent_summary}\nPain points: {pain_points}",
+            },
+        ],
+        max_tokens=2048,
+        response_format=ImprovedHeadlines,
+    )
+
+    new_headlines = new_completion.choices[0].message.parsed
+    if not new_headlines:
+        raise ValueError("No improved headlines found")
+    return new_headlines
+
+
+async def process_and_update(
+    args: Tuple[str, Optional[str], Optional[List[str]]],
+    semaphore: asyncio.Semaphore,
 ) -> dict:
-    """Process a single ad, update database, and track stats"""
-    image_url, existing_headlines, intent_summary, pain_points, stats = args
+    """Process a single ad and update database"""
+    image_url, intent_summary, pain_points = args
     results = {
         "image_url": image_url,
         "success": False,
@@ -57,151 +140,84 @@ def process_and_update(
         "time_taken": 0,
     }
 
-    if existing_headlines:
-        results["success"] = True
-        results["original_headlines"] = existing_headlines
-        with stats["lock"]:
-            stats["processed"] += 1
-            stats["successful"] += 1
-        return results
-
     time_start = time.time()
     try:
-        openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-        # Extract original headlines
-        completion = openai_client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": HEADLINE_EXTRACTION_PROMPT,
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Generate compelling headlines for this ad that align with its visual elements and marketing goals.",
-                        },
-                        {"type": "image_url", "image_url": {"url": image_url}},
-                    ],
-                },
-            ],
-            max_tokens=2048,
-            response_format=OriginalImageHeadlines,
-        )
-
-        original_headlines = completion.choices[0].message.parsed
-        if not original_headlines:
-            raise ValueError("No original headlines found")
-
-        results["original_headlines"] = original_headlines.headlines
-        # print(f"Original headlines: {original_headlines.headlines}")
-
-        # Generate improved headlines
-        new_completion = openai_client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": HEADLINE_IMPROVEMENT_PROMPT,
-                },
-                {
-                    "role": "user",
-                    "content": f"Original headlines: {original_headlines}\nIntent summary: {intent_summary}\nPain points: {pain_points}",
-                },
-            ],
-            max_tokens=2048,
-            response_format=ImprovedHeadlines,
-        )
-
-        new_headlines = new_completion.choices[0].message.parsed
-        if not new_headlines:
-            raise ValueError("No improved headlines found")
+        async with semaphore:
+            original_headlines = await extract_headlines(image_url)
+            results["original_headlines"] = original_headlines.headlines
 
-        results["new_headlines"] = new_headlines.headlines
-        # print(f"New headlines: {new_headlines.headlines}")
+            new_headlines = await improve_headlines(
+                original_headlines, intent_summary, pain_points
+            )
+            results["new_headlines"] = new_headlines.headlines
         results["success"] = True
 
         # Update database immediately
-        update_database(results)
-
-        # Update stats
-        with stats["lock"]:
-            stats["successful"] += 1
+        await asyncio.to_thread(update_database, results)
 
     except Exception as e:
         results["error"] = str(e)
         print(f"Error processing ad {image_url}: {e}")
-        with stats["lock"]:
-            stats["failed"].append((image_url, str(e)))
-    finally:
-        results["time_taken"] = time.time() - time_start
-        print(f"Time taken for {image_url}: {results['time_taken']:.2f} seconds")
-        with stats["lock"]:
-            stats["processed"] += 1
-        return results
+
+    results["time_taken"] = time.time() - time_start
+    print(f"Time taken for {image_url}: {results['time_taken']:.2f} seconds")
+    return results
 
 
-def main():
+async def main():
     """Process all ads and generate headlines"""
-    # Get all research data
-    supabase = get_supabase_client()
-    research_data = supabase.table("market_research_v2").select("*").execute().data
-
-    # Set up shared stats tracking
-    manager = Manager()
-    stats = manager.dict(
-        {
-            "processed": 0,
-            "successful": 0,
-            "failed": manager.list(),
-            "lock": manager.Lock(),
-        }
-    )
+    # Get the research data for ads still missing headlines
+    research_data = await asyncio.to_thread(fetch_pending_research)
 
     # Prepare work items
     work_items = [
         (
             r["image_url"],
-            r.get("headlines"),
             r.get("intent_summary"),
             r.get("pain_points"),
-            stats,
         )
         for r in research_data
     ]
 
-    # Use multiprocessing pool
-    num_processes = min(cpu_count(), 10)  # Use at most 10 processes
-    print(f"Starting pool with {num_processes} processes")
-
-    with Pool(num_processes) as pool:
-        # Process ads with progress tracking
-        for _ in tqdm(
-            pool.imap_unordered(process_and_update, work_items),
-            total=len(work_items),
-            desc="Processing ads",
-        ):
-            # Print current stats
-            print(
-                f"\rProcessed: {stats['processed']}/{len(work_items)} "
-                f"(Success: {stats['successful']}, "
-                f"Failed: {len(stats['failed'])})",
-                end="",
-            )
+    # Stats live in this one event loop, so plain counters are enough
+    processed = 0
+    successful = 0
+    failed: list[tuple[str, str]] = []
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    tasks = [process_and_update(item, semaphore) for item in work_items]
+
+    # Process ads with progress tracking
+    for task in tqdm(
+        asyncio.as_completed(tasks),
+        total=len(tasks),
+        desc="Processing ads",
+    ):
+        results = await task
+        processed += 1
+        if results["success"]:
+            successful += 1
+        else:
+            failed.append((results["image_url"], results["error"]))
+
+        # Print current stats
+        print(
+            f"\rProcessed: {processed}/{len(work_items)} "
+            f"(Success: {successful}, "
+            f"Failed: {len(failed)})",
+            end="",
+        )
 
     # Print final summary
     print("\n\nProcessing complete:")
-    print(f"Total processed: {stats['processed']}")
-    print(f"Successful: {stats['successful']}")
-    print(f"Failed: {len(stats['failed'])}")
-    if stats["failed"]:
+    print(f"Total processed: {processed}")
+    print(f"Successful: {successful}")
+    print(f"Failed: {len(failed)}")
+    if failed:
         print("\nFailed URLs:")
-        for url, error in stats["failed"]:
+        for url, error in failed:
             print(f"{url}: {error}")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,102 +1,330 @@
+import asyncio
+import itertools
+import json
 import os
+import sys
 import time
 from typing import List
-from openai import OpenAI
+from openai import AsyncOpenAI
 from helpers import get_supabase_client
 from models import Keywords, GPTStructuredMarketResearch
 from prompts import KEYWORD_GENERATION_PROMPT
 import dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential
-from multiprocessing import Pool, cpu_count
+import httpx
 from tqdm import tqdm
 
 # Load environment variables
 dotenv.load_dotenv("../../.env.local")
 
+# A comma separated OPENAI_API_KEYS spreads requests across keys so their rate
+# limits add up; a single OPENAI_API_KEY still works on its own
+OPENAI_API_KEYS = [
+    key.strip()
+    for key in os.getenv("OPENAI_API_KEYS", os.getenv("OPENAI_API_KEY", "")).split(",")
+    if key.strip()
+]
+if not OPENAI_API_KEYS:
+    raise ValueError("Set OPENAI_API_KEYS or OPENAI_API_KEY")
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def generate_keywords_for_research(args) -> None:
-    """Generate keywords for a single research item"""
-    research_data, image_url, keywords = args
-    if keywords:
-        print(f"Keywords already generated for {image_url}")
-        return
+# One pooled HTTP client shared by every request, sized above the concurrency
+# limit so requests never wait on a free connection
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+)
+# The SDK retries only the failed request itself, backing off as the
+# Retry-After header asks
+openai_clients = [
+    AsyncOpenAI(api_key=key, max_retries=3, timeout=60.0, http_client=http_client)
+    for key in OPENAI_API_KEYS
+]
 
-    time_start = time.time()
+# Number of research items being sent through each OpenAI key at once
+MAX_CONCURRENT_REQUESTS = 32
+# Number of keyword rows written back per database call
+SAVE_BATCH_SIZE = 500
+# Number of research items scheduled at once, which bounds live tasks and memory
+WORK_CHUNK_SIZE = 500
+# Number of image URLs per ad description lookup, keeping the request URL short
+DESCRIPTION_LOOKUP_SIZE = 100
+# Rows per page when reading research, matching Supabase's response row cap
+PAGE_SIZE = 1000
+# Columns of market_research_v2 that the keyword prompt is built from
+RESEARCH_COLUMNS = (
+    "id, image_url, intent_summary, target_audience, pain_points, buying_stage, "
+    "key_features, competitive_advantages"
+)
+# Longest ad description sent in a prompt, in characters
+MAX_AD_DESCRIPTION_LENGTH = 1000
+# Seconds between status checks while a Batch API job runs
+BATCH_POLL_INTERVAL_SECONDS = 60
 
-    try:
-        research = GPTStructuredMarketResearch.model_validate(research_data)
-
-        # Create research summary for context
-        research_context = {
-            "intent": research.intent_summary,
-            "audience": [seg.model_dump() for seg in research.target_audience],
-            "pain_points": research.pain_points,
-            "stage": research.buying_stage,
-            "features": [feat.model_dump() for feat in research.key_features],
-            "advantages": research.competitive_advantages,
-        }
-
-        # Get ad description
-        supabase = get_supabase_client()
-        ad_description = (
+
+def chunks(items: list, size: int):
+    """Yield consecutive slices of items of at most size elements"""
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def fetch_pending_research() -> list[dict]:
+    """Fetch the research columns needed for rows that have no keywords yet"""
+    supabase = get_supabase_client()
+    rows: list[dict] = []
+    while True:
+        page = (
+            supabase.table("market_research_v2")
+            .select(RESEARCH_COLUMNS)
+            .is_("keywords", "null")
+            .order("id")
+            .range(len(rows), len(rows) + PAGE_SIZE - 1)
+            .execute()
+            .data
+        )
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+
+
+def fetch_ad_descriptions(image_urls: list[str]) -> dict[str, str]:
+    """Map image URLs to their ad descriptions with a few IN queries"""
+    supabase = get_supabase_client()
+    descriptions: dict[str, str] = {}
+    for i in range(0, len(image_urls), DESCRIPTION_LOOKUP_SIZE):
+        rows = (
             supabase.table("ad_structured_output")
-            .select("image_description")
-            .eq("image_url", image_url)
+            .select("image_url, image_description")
+            .in_("image_url", image_urls[i : i + DESCRIPTION_LOOKUP_SIZE])
             .execute()
-            .data[0]["image_description"]
+            .data
         )
+        for row in rows:
+            descriptions.setdefault(row["image_url"], row["image_description"])
+    return descriptions
+
+
+def build_messages(research_data: dict, ad_description: str) -> list[dict]:
+    """Build the keyword generation prompt for a single research item"""
+    research = GPTStructuredMarketResearch.model_validate(research_data)
+
+    # Create a compact research summary for context, keeping only the fields
+    # that steer keyword choice since prompt tokens drive cost and latency
+    research_context = {
+        "intent": research.intent_summary,
+        "audience": [seg.name for seg in research.target_audience],
+        "pain_points": research.pain_points[:3],
+        "stage": research.buying_stage,
+        "features": [
+            {"name": feat.name, "score": feat.importance_score}
+            for feat in research.key_features[:5]
+        ],
+        "advantages": research.competitive_advantages,
+    }
+    research_json = json.dumps(research_context, separators=(",", ":"))
+
+    return [
+        {"role": "system", "content": KEYWORD_GENERATION_PROMPT},
+        {
+            "role": "user",
+            "content": f"Generate long-tail keywords for this ad based on this market research: {research_json} and ad description: {ad_description[:MAX_AD_DESCRIPTION_LENGTH]}",
+        },
+    ]
+
+
+def save_keywords(rows: list[dict]) -> None:
+    """Write a batch of {"id", "keywords"} rows back to the database"""
+    # set_market_research_keywords only sets keywords, so edits made to other
+    # research columns while the run was in flight are left alone
+    try:
+        get_supabase_client().rpc(
+            "set_market_research_keywords", {"updates": rows}
+        ).execute()
+    except Exception as e:
+        # Log and move on so one failed write does not drop every later batch
+        print(f"Error saving keywords for {[row['id'] for row in rows]}: {e}")
+
+
+def resave_keywords(results_file: str) -> None:
+    """Write back keywords saved locally by an earlier --batch run"""
+    with open(results_file) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    for batch in chunks(rows, SAVE_BATCH_SIZE):
+        save_keywords(batch)
+
+
+async def generate_keywords_for_research(
+    args, openai_client: AsyncOpenAI, semaphore: asyncio.Semaphore
+) -> dict | None:
+    """Generate keywords for a single research item, returning the row to save"""
+    research_data, image_url, ad_description = args
+    time_start = time.time()
+
+    try:
+        if ad_description is None:
+            raise ValueError("No ad description found")
 
         # Generate keywords
-        openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        completion = openai_client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": KEYWORD_GENERATION_PROMPT},
-                {
-                    "role": "user",
-                    "content": f"Generate long-tail keywords for this ad based on this market research: {research_context} and ad description: {ad_description}",
-                },
-            ],
-            response_format=Keywords,
-            temperature=0.7,
-        )
+        async with semaphore:
+            completion = await openai_client.beta.chat.completions.parse(
+                model="gpt-4o-mini",
+                messages=build_messages(research_data, ad_description),
+                response_format=Keywords,
+                temperature=0.7,
+            )
 
         keywords = completion.choices[0].message.parsed
         if keywords:
-            # Update the record with generated keywords
-            supabase.table("market_research_v2").update(
-                {"keywords": keywords.model_dump()["keywords"]}
-            ).eq("image_url", image_url).execute()
+            # Return the generated keywords for the batched write-back
+            return {
+                "id": research_data["id"],
+                "keywords": keywords.model_dump()["keywords"],
+            }
 
     except Exception as e:
         print(f"Error processing research for {image_url}: {e}")
     finally:
         print(f"Time taken: {time.time() - time_start:.2f} seconds")
+    return None
+
+
+async def run_batch_job(work_items: list[tuple]) -> list[dict]:
+    """Generate keywords through the Batch API, returning the rows to save"""
+    # Private SDK helper, imported here so an SDK upgrade that moves it only
+    # affects batch mode; it builds the strict schema chat.completions.parse sends
+    from openai.lib._parsing._completions import type_to_response_format_param
+
+    keywords_response_format = type_to_response_format_param(Keywords)
+    openai_client = openai_clients[0]
+    request_lines: list[str] = []
+    for research_data, image_url, ad_description in work_items:
+        if ad_description is None:
+            print(f"No ad description found for {image_url}")
+            continue
+
+        # image_url is not unique in market_research_v2, so key on the row id
+        custom_id = str(research_data["id"])
+        request_lines.append(
+            json.dumps(
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": "gpt-4o-mini",
+                        "messages": build_messages(research_data, ad_description),
+                        "response_format": keywords_response_format,
+                        "temperature": 0.7,
+                    },
+                }
+            )
+        )
+
+    if not request_lines:
+        return []
+
+    input_file = await openai_client.files.create(
+        file=("keyword_requests.jsonl", "\n".join(request_lines).encode()),
+        purpose="batch",
+    )
+    batch = await openai_client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"Submitted batch {batch.id} with {len(request_lines)} requests")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_INTERVAL_SECONDS)
+        batch = await openai_client.batches.retrieve(batch.id)
+        print(f"Batch {batch.id} is {batch.status}")
+
+    if batch.status != "completed":
+        print(f"Batch {batch.id} finished as {batch.status}")
+
+    # Requests that failed outright are reported in a separate error file
+    if batch.error_file_id is not None:
+        errors = await openai_client.files.content(batch.error_file_id)
+        for line in errors.text.splitlines():
+            print(f"Error processing research: {line}")
+
+    if batch.output_file_id is None:
+        return []
 
+    # Expired or cancelled batches still return the results they finished, and
+    # one bad completion must not discard the rest of an already paid-for batch
+    output = await openai_client.files.content(batch.output_file_id)
+    rows_to_save: list[dict] = []
+    for line in output.text.splitlines():
+        try:
+            result = json.loads(line)
+            response = result["response"]
+            if result["error"] or response["status_code"] != 200:
+                raise ValueError(result["error"] or response["body"])
 
-def main():
+            content = response["body"]["choices"][0]["message"]["content"]
+            keywords = Keywords.model_validate_json(content)
+            rows_to_save.append(
+                {
+                    "id": result["custom_id"],
+                    "keywords": keywords.model_dump()["keywords"],
+                }
+            )
+        except Exception as e:
+            print(f"Error processing batch output line {line[:200]}: {e}")
+
+    # Keep a local copy of the paid-for results before touching the database,
+    # so a failed write-back can be retried with --resave instead of a new batch
+    results_file = f"keyword_batch_{batch.id}.jsonl"
+    with open(results_file, "w") as f:
+        f.writelines(json.dumps(row) + "\n" for row in rows_to_save)
+    print(f"Saved {len(rows_to_save)} batch results to {results_file}")
+    return rows_to_save
+
+
+async def main(use_batch_api: bool = False):
     """Process all market research and generate keywords"""
-    # Get all research data
-    supabase = get_supabase_client()
-    research_data = supabase.table("market_research_v2").select("*").execute().data
+    # Get the research data that still needs keywords
+    research_data = await asyncio.to_thread(fetch_pending_research)
+
+    # Look up every ad description up front instead of once per item
+    ad_descriptions = await asyncio.to_thread(
+        fetch_ad_descriptions,
+        [r["image_url"] for r in research_data],
+    )
 
     # Prepare work items
-    work_items = [(r, r["image_url"], r["keywords"]) for r in research_data]
-
-    # Use multiprocessing pool
-    num_processes = min(cpu_count(), 10)  # Use at most 10 processes
-    print(f"Starting pool with {num_processes} processes")
-
-    with Pool(num_processes) as pool:
-        list(
-            tqdm(
-                pool.imap_unordered(generate_keywords_for_research, work_items),
-                total=len(work_items),
-                desc="Generating keywords",
+    work_items = [
+        (r, r["image_url"], ad_descriptions.get(r["image_url"])) for r in research_data
+    ]
+
+    if use_batch_api:
+        rows_to_save = await run_batch_job(work_items)
+        for rows in chunks(rows_to_save, SAVE_BATCH_SIZE):
+            await asyncio.to_thread(save_keywords, rows)
+        return
+
+    # Round-robin items across the keys, each with its own concurrency budget
+    semaphores = [asyncio.Semaphore(MAX_CONCURRENT_REQUESTS) for _ in openai_clients]
+    assignments = itertools.cycle(zip(openai_clients, semaphores))
+
+    with tqdm(total=len(work_items), desc="Generating keywords") as pbar:
+        for chunk in chunks(work_items, WORK_CHUNK_SIZE):
+            rows = await asyncio.gather(
+                *(
+                    generate_keywords_for_research(item, *next(assignments))
+                    for item in chunk
+                )
             )
-        )
+            pbar.update(len(chunk))
+
+            rows_to_save = [row for row in rows if row]
+            if rows_to_save:
+                await asyncio.to_thread(save_keywords, rows_to_save)
 
 
 if __name__ == "__main__":
-    main()
+    # --resave <file> writes back the results a previous --batch run kept locally
+    if len(sys.argv) == 3 and sys.argv[1] == "--resave":
+        resave_keywords(sys.argv[2])
+        sys.exit(0)
+
+    # --batch trades latency for the Batch API's lower cost on bulk refreshes
+    asyncio.run(main(use_batch_api="--batch" in sys.argv[1:]))
@@ -1,11 +1,15 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 from supabase import create_client
 
 load_dotenv(".env.local")
 
 
+@lru_cache(maxsize=1)
 def get_supabase_client():
+    # Environment is read on the first call rather than at import, since the
+    # scripts load ../../.env.local only after importing this module
     return create_client(
         os.getenv("NEXT_PUBLIC_SUPABASE_URL"),
         os.getenv("NEXT_PUBLIC_SUPABASE_SERVICE_KEY"),
@@ -1,6 +1,6 @@
 from functools import lru_cache
 import asyncio
-from brave_search import brave_web_search
+from brave_search import brave_web_search, close_session
 from models import (
     AdStructuredOutput,
     CombinedMarketResearch,
@@ -345,6 +345,7 @@ async def pipeline():
 
         # Wait for workers to finish
         await asyncio.gather(*workers, return_exceptions=True)
+        await close_session()
         pbar.close()
 
 
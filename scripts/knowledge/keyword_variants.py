@@ -15,6 +15,7 @@ import csv
 import uuid
 import re
 import random
+import time
 import aiohttp
 import traceback
 import pandas as pd
@@ -35,6 +36,9 @@ load_dotenv(env_path)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How long the joined market research/library rows are reused before refetching
+JOINED_DATA_TTL_SECONDS = 300
+
 
 class AdFeatures(BaseModel):
     """Extracted features from Nike display ad"""
@@ -101,6 +105,10 @@ class KeywordVariantGenerator:
             # Initialize LLM
             self.llm = OpenAI(model="gpt-4o-mini", temperature=0.2)
 
+            # Cached result of the join_market_research_and_library_items RPC
+            self._joined_data: Optional[List[Dict]] = None
+            self._joined_data_fetched_at = 0.0
+
             # Initialize vector store and index for ad retrieval
             self._initialize_ad_index()
 
@@ -112,6 +120,22 @@ class KeywordVariantGenerator:
             logger.error(f"Error initializing KeywordVariantGenerator: {str(e)}")
             raise
 
+    def _get_joined_data(self) -> List[Dict]:
+        """Return the joined market research and library rows, reusing a recent fetch"""
+        now = time.monotonic()
+        if (
+            self._joined_data is not None
+            and now - self._joined_data_fetched_at < JOINED_DATA_TTL_SECONDS
+        ):
+            return self._joined_data
+
+        joined_data_response = self.supabase.rpc(
+            "join_market_research_and_library_items"
+        ).execute()
+        self._joined_data = joined_data_response.data or []
+        self._joined_data_fetched_at = now
+        return self._joined_data
+
     def _initialize_ad_index(self):
         """Initialize vector store and index with ad data from available tables"""
         try:
@@ -119,10 +143,7 @@ class KeywordVariantGenerator:
             # Use the RPC function to get joined data from market research and library items
             logger.info("Calling RPC function 'join_market_research_and_library_items'")
             try:
-                joined_data_response = self.supabase.rpc(
-                    "join_market_research_and_library_items"
-                ).execute()
-                joined_data = joined_data_response.data
+                joined_data = self._get_joined_data()
                 logger.info(
                     f"RPC function returned {len(joined_data) if joined_data else 0} records"
                 )
@@ -441,10 +462,7 @@ class KeywordVariantGenerator:
                     "Calling RPC function 'join_market_research_and_library_items' from _retrieve_similar_content"
                 )
                 try:
-                    joined_data_response = self.supabase.rpc(
-                        "join_market_research_and_library_items"
-                    ).execute()
-                    joined_data = joined_data_response.data
+                    joined_data = self._get_joined_data()
                     logger.info(
                         f"RPC function returned {len(joined_data) if joined_data else 0} records"
                     )
@@ -598,10 +616,7 @@ class KeywordVariantGenerator:
                 "Calling RPC function 'join_market_research_and_library_items' from _incorporate_joined_data"
             )
             try:
-                joined_data_response = self.supabase.rpc(
-                    "join_market_research_and_library_items"
-                ).execute()
-                joined_data = joined_data_response.data
+                joined_data = self._get_joined_data()
                 logger.info(
                     f"RPC function returned {len(joined_data) if joined_data else 0} records"
                 )
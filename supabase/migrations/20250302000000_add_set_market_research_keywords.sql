@@ -0,0 +1,16 @@
+-- Bulk-set market_research_v2.keywords without touching any other column.
+-- Takes a JSON array of {"id": uuid, "keywords": [...]} objects and returns
+-- the number of rows updated; used by scripts/keywords/generate_keywords.py
+CREATE OR REPLACE FUNCTION public.set_market_research_keywords(updates jsonb)
+RETURNS integer
+LANGUAGE sql
+AS $function$
+  WITH updated AS (
+    UPDATE public.market_research_v2 AS mr
+    SET keywords = ARRAY(SELECT jsonb_array_elements(u.keywords))
+    FROM jsonb_to_recordset(updates) AS u(id uuid, keywords jsonb)
+    WHERE mr.id = u.id
+    RETURNING mr.id
+  )
+  SELECT count(*)::integer FROM updated;
+$function$;
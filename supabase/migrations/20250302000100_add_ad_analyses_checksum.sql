@@ -0,0 +1,16 @@
+-- Checksum over the ids of every table that makes up an ad analysis, so
+-- scripts/ads/helpers.py can tell in one call whether its cache is stale.
+-- Ids are random UUIDs, so replaced rows change the checksum even when the
+-- row counts stay the same.
+CREATE OR REPLACE FUNCTION public.ad_analyses_checksum()
+RETURNS text
+LANGUAGE sql
+STABLE
+AS $function$
+  SELECT md5(concat_ws('|',
+    coalesce((SELECT string_agg(id::text, ',' ORDER BY id) FROM public.ad_structured_output), ''),
+    coalesce((SELECT string_agg(id::text, ',' ORDER BY id) FROM public.features), ''),
+    coalesce((SELECT string_agg(id::text, ',' ORDER BY id) FROM public.visual_attributes), ''),
+    coalesce((SELECT string_agg(id::text, ',' ORDER BY id) FROM public.sentiment_analysis), '')
+  ));
+$function$;